@@ -10,30 +10,24 @@ import sys
 import os
 import json
 from enum import Enum
-from typing import Literal
+from typing import Iterator, Literal
 import argparse
-from rply import LexerGenerator, Token, LexingError
 from g1.assembler.data import parse_data
-from g1.binary.binary_format import G1BinaryFormat, format_json
+from g1.assembler.lexer import Token, LexingError, tokenize
+from g1.binary.binary_format import build_program_binary
 from g1.instructions.instructions import INSTRUCTIONS, ARGUMENT_COUNT_LOOKUP, ASSIGNMENT_INSTRUCTIONS
 
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
 
 class AssemblerState(Enum):
     META = 1
     PROCEDURES = 2
 
 
-lg = LexerGenerator()
-lg.add('META_VARIABLE', r'#[A-z]+')
-lg.add('NUMBER', r'-?\d+')
-lg.add('ADDRESS', r'\$\d+')
-lg.add('LABEL_NAME', r'[A-z0-9_]+:')
-lg.add('NAME', r'[A-z_][A-z0-9_]*')
-lg.add('COMMENT', r'\([^)]*\)')
-lg.add('NEWLINE', r'\n')
-lg.ignore(r' ')
-lexer = lg.build()
-
 META_VARIABLES = {
     'memory': 128,
     'width': 100,
@@ -47,6 +41,18 @@ DEFAULT_OUTPUT_FORMAT = 'json'
 INT_RANGE_LOWER = -2**31
 INT_RANGE_UPPER = 2**31-1
 
+# Results of assignment instructions whose operands are all literals, computed the same way as the VM
+CONSTANT_FOLDS = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'mul': lambda a, b: a * b,
+    'div': lambda a, b: a // b,
+    'mod': lambda a, b: a % b,
+    'less': lambda a, b: int(a < b),
+    'equal': lambda a, b: int(a == b),
+    'not': lambda a: int(not a)
+}
+
 COLOR_ERROR = '\x1b[31m'
 COLOR_WARN = '\x1b[33m'
 COLOR_RESET = '\x1b[0m'
@@ -71,92 +77,135 @@ def warn(token: Token, source_lines: list[str], message: str):
     print(COLOR_RESET, end='')
 
 
-def get_until_newline(tokens: list[Token]) -> list[Token]:
-    returned_tokens = []
-    while True:
-        token = tokens.next()
-        if token.name == 'COMMENT':
-            continue
+def split_lines(tokens: Iterator[Token]) -> Iterator[list[Token]]:
+    """
+    Groups tokens into their source lines, leaving out comments and newlines.
+    Empty lines are skipped.
+    """
+    line = []
+    for token in tokens:
         if token.name == 'NEWLINE':
-            break
-        returned_tokens.append(token)
-    return returned_tokens
-
-
-def parse_argument_token(token: Token, labels: dict[str, int], source_lines: list[str]) -> str | int:
-    if token.name == 'NUMBER':
-        parsed = int(token.value)
-        if parsed < INT_RANGE_LOWER or parsed > INT_RANGE_UPPER:
-            error(token, source_lines, f'Integer value {token.value} is outside the 32 bit signed integer range.')
-        return parsed
-    if token.name == 'NAME':
-        if token.value not in labels:
-            error(token, source_lines, f'Undefined label "{token.value}".')
-        return labels[token.value]
-    if token.name == 'ADDRESS':
-        parsed_address = int(token.value[1:])
-        if parsed_address < INT_RANGE_LOWER or parsed_address > INT_RANGE_UPPER:
-            error(token, source_lines, f'Address value {token.value} is outside the 32 bit signed integer range.')
-        return token.value
-    return token.value
+            if line:
+                yield line
+                line = []
+        elif token.name != 'COMMENT':
+            line.append(token)
+    if line:
+        yield line
+
+
+def warn_reserved_assignment(instruction_name: str, first_argument: int | str | None, token: Token, source_lines: list[str]):
+    if instruction_name in ASSIGNMENT_INSTRUCTIONS and isinstance(first_argument, int) and first_argument <= 11:
+        warn(token, source_lines, 'Assignment to a reserved memory location.')
+
+
+def fold_constants(instructions: list[list]):
+    """
+    Replaces assignment instructions with only literal operands by a `mov` of their result.
+    Divisions by zero are left for the VM to report.
+    """
+    for instruction_data in instructions:
+        instruction_name, instruction_args = instruction_data[0], instruction_data[1]
+        fold = CONSTANT_FOLDS.get(instruction_name)
+        if fold is None:
+            continue
+        operands = instruction_args[1:]
+        if not all(isinstance(operand, int) for operand in operands):
+            continue
+        if instruction_name in {'div', 'mod'} and operands[1] == 0:
+            continue
+        result = (fold(*operands) - INT_RANGE_LOWER) % 2**32 + INT_RANGE_LOWER  # wrap to 32 bits
+        instruction_data[0] = 'mov'
+        instruction_data[1] = [instruction_args[0], result]
 
 
-def assemble_tokens(tokens: list[Token], source_lines: list[str], compiler_state: AssemblerState, debug: bool=False) -> dict:
+def assemble_tokens(tokens: Iterator[Token], source_lines: list[str], compiler_state: AssemblerState, debug: bool=False) -> dict:
     output_json = {'meta': META_VARIABLES.copy()}
     
     labels = {}
-    raw_instructions = []
-    instruction_index = 0
+    instructions = []
+    pending_label_fixups: list[tuple[int, int, Token]] = []  # (instruction index, argument index, label token)
 
-    for token in tokens:
-        if token.name == 'META_VARIABLE':
-            if compiler_state != AssemblerState.META:
-                error(token, source_lines, f'Found meta variable outside file header.')
-            meta_variable_name = token.value[1:]
-            if meta_variable_name not in META_VARIABLES:
-                error(token, source_lines, f'Unrecognized meta variable "{meta_variable_name}".')
-            output_json['meta'][meta_variable_name] = int(tokens.next().value)
-        
-        elif token.name == 'LABEL_NAME':
-            if compiler_state != AssemblerState.PROCEDURES:
-                compiler_state = AssemblerState.PROCEDURES
-            label_name = token.value[:-1]
-            if label_name in labels:
-                warn(token, source_lines, f'Label "{label_name}" declared more than once.')
-            else:
-                labels[label_name] = instruction_index
-        
-        elif token.name == 'NAME':
-            if token.value not in INSTRUCTIONS:
-                error(token, source_lines, f'Unrecognized instruction "{token.value}".')
-
-            instruction_name_token = token.value
-            instruction_arg_amount = ARGUMENT_COUNT_LOOKUP[token.value]
-            instruction_args = get_until_newline(tokens)
-            if len(instruction_args) != instruction_arg_amount:
-                error(token, source_lines, f'Expected {instruction_arg_amount} argument(s) for instruction "{instruction_name_token}" but got {len(instruction_args)}.')
-            raw_instructions.append([token, instruction_args])
-            instruction_index += 1
-        
-        elif token.name in {'NUMBER', 'ADDRESS'}:
-            error(token, source_lines, 'Value outside of instruction.')
+    def parse_argument_token(token: Token) -> str | int:
+        """
+        Converts an argument token to its value, resolving labels with the labels declared so far.
+        """
+        if token.name == 'NUMBER':
+            parsed = int(token.value)
+            if parsed < INT_RANGE_LOWER or parsed > INT_RANGE_UPPER:
+                error(token, source_lines, f'Integer value {token.value} is outside the 32 bit signed integer range.')
+            return parsed
+        if token.name == 'NAME':
+            if token.value not in labels:
+                error(token, source_lines, f'Undefined label "{token.value}".')
+            return labels[token.value]
+        if token.name == 'ADDRESS':
+            parsed_address = int(token.value[1:])
+            if parsed_address < INT_RANGE_LOWER or parsed_address > INT_RANGE_UPPER:
+                error(token, source_lines, f'Address value {token.value} is outside the 32 bit signed integer range.')
+            return token.value
+        return token.value
+
+    for line in split_lines(tokens):
+        line_tokens = iter(line)
+        for token in line_tokens:
+            if token.name == 'META_VARIABLE':
+                if compiler_state != AssemblerState.META:
+                    error(token, source_lines, f'Found meta variable outside file header.')
+                meta_variable_name = token.value[1:]
+                if meta_variable_name not in META_VARIABLES:
+                    error(token, source_lines, f'Unrecognized meta variable "{meta_variable_name}".')
+                value_token = next(line_tokens, None)
+                if value_token is None or value_token.name != 'NUMBER':
+                    error(token, source_lines, f'Expected a number for meta variable "{meta_variable_name}".')
+                output_json['meta'][meta_variable_name] = int(value_token.value)
+            
+            elif token.name == 'LABEL_NAME':
+                if compiler_state != AssemblerState.PROCEDURES:
+                    compiler_state = AssemblerState.PROCEDURES
+                label_name = token.value[:-1]
+                if label_name in labels:
+                    warn(token, source_lines, f'Label "{label_name}" declared more than once.')
+                else:
+                    labels[label_name] = len(instructions)
+            
+            elif token.name == 'NAME':
+                if token.value not in INSTRUCTIONS:
+                    error(token, source_lines, f'Unrecognized instruction "{token.value}".')
+
+                instruction_name = token.value
+                instruction_arg_amount = ARGUMENT_COUNT_LOOKUP[token.value]
+                instruction_args_tokens = list(line_tokens)  # the rest of the line
+                if len(instruction_args_tokens) != instruction_arg_amount:
+                    error(token, source_lines, f'Expected {instruction_arg_amount} argument(s) for instruction "{instruction_name}" but got {len(instruction_args_tokens)}.')
+                
+                # parse instruction args, leaving labels that aren't declared yet to be resolved after this pass
+                instruction_args = []
+                for arg_index, arg_token in enumerate(instruction_args_tokens):
+                    if arg_token.name == 'NAME' and arg_token.value not in labels:
+                        pending_label_fixups.append((len(instructions), arg_index, arg_token))
+                        instruction_args.append(None)
+                    else:
+                        instruction_args.append(parse_argument_token(arg_token))
+                warn_reserved_assignment(instruction_name, instruction_args[0], instruction_args_tokens[0], source_lines)
+                
+                instruction_data = [instruction_name, instruction_args]
+                if debug:
+                    instruction_data.append(token.source_pos.lineno-1)
+                instructions.append(instruction_data)
+            
+            elif token.name in {'NUMBER', 'ADDRESS'}:
+                error(token, source_lines, 'Value outside of instruction.')
         
-        elif token.name in {'COMMENT', 'NEWLINE'}:
-            continue
-    
-    # parse instruction args
-    instructions = []
-    for instruction_name_token, instruction_args_tokens in raw_instructions:
-        instruction_name = instruction_name_token.value 
-        instruction_args = [parse_argument_token(t, labels, source_lines) for t in instruction_args_tokens]
-        instruction_data = [instruction_name, instruction_args]
-        first_argument = instruction_args[0]
-        if instruction_name in ASSIGNMENT_INSTRUCTIONS and isinstance(first_argument, int) and first_argument <= 11:
-            warn(instruction_args_tokens[0], source_lines, 'Assignment to a reserved memory location.')
-        if debug:
-            instruction_data.append(instruction_name_token.source_pos.lineno-1)
-        instructions.append(instruction_data)
+    # resolve forward label references
+    for instruction_index, arg_index, arg_token in pending_label_fixups:
+        instruction_data = instructions[instruction_index]
+        instruction_name, instruction_args = instruction_data[0], instruction_data[1]
+        instruction_args[arg_index] = parse_argument_token(arg_token)
+        if arg_index == 0:
+            warn_reserved_assignment(instruction_name, instruction_args[0], arg_token, source_lines)
     
+    fold_constants(instructions)
     output_json['instructions'] = instructions
     if 'tick' in labels:
         output_json['tick'] = labels['tick']
@@ -177,7 +226,7 @@ def assemble(input_path: str, output_path: str, data_file_path: str|None, debug:
         source_code = f.read()
     
     source_lines = source_code.split('\n')
-    tokens = lexer.lex(source_code + '\n')
+    tokens = tokenize(source_code + '\n')
     try:
         output_json = assemble_tokens(tokens, source_lines, AssemblerState.META, debug)
     except LexingError as e:
@@ -191,10 +240,12 @@ def assemble(input_path: str, output_path: str, data_file_path: str|None, debug:
 
     # Set file content based on the output format
     if output_format == 'json':
-        file_content = json.dumps(output_json, separators=(',', ':')).encode('utf-8')
+        if orjson is not None:
+            file_content = orjson.dumps(output_json)
+        else:
+            file_content = json.dumps(output_json, separators=(',', ':')).encode('utf-8')
     else:
-        formatted_json = format_json(output_json)
-        file_content = G1BinaryFormat.build(formatted_json)
+        file_content = build_program_binary(output_json)
     
     # Write the output file
     with open(output_path, 'wb') as f:
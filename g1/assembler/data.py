@@ -4,12 +4,21 @@ Allows external data to be attached to assembled g1 programs via g1d files.
 
 import os
 import re
-from PIL import Image 
+import stat
 from io import BytesIO 
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
+# PIL and numpy are imported when an image is first parsed since importing them
+# takes up most of the assembler's startup time.
+if TYPE_CHECKING:
+    from PIL import Image
 
-DATA_LINE_REGEX = r'^(\d+) ([fFbs]) (.+)$'
-HEX_REGEX = r'(:?[0-9a-fA-F]{2})+$'
+
+DATA_TYPES = {'f', 'F', 'b', 's'}
+HEX_REGEX = r'(?:[0-9a-fA-F]{2})+$'
+
+HEX_PATTERN = re.compile(HEX_REGEX)
 
 
 class G1DataParserException(Exception):
@@ -20,27 +29,48 @@ def error(line_number: str, message: str):
     print(f'DATA ERROR: Line {line_number+1}: {message}')
 
 
-def img_to_simg(img: Image.Image) -> list[int]:
+def img_to_simg(img: 'Image.Image') -> list[int]:
+    img = img.convert('RGB')
+    try:
+        import numpy as np
+    except ImportError:  # numpy is optional
+        np = None
+
+    if np is not None:
+        pixels = np.asarray(img, dtype=np.uint32)
+        packed = (pixels[..., 2] << 16) | (pixels[..., 1] << 8) | pixels[..., 0]
+        return [img.width, img.height] + packed.ravel().tolist()
+
+    pixels = img.load()
     simg_data = [img.width, img.height]
     for i in range(img.height):
         for j in range(img.width):
-            pixel = img.getpixel((j, i))
-            pixel_int = pixel[2]
-            pixel_int <<= 8
-            pixel_int |= pixel[1]
-            pixel_int <<= 8
-            pixel_int |= pixel[0]
-            simg_data.append(pixel_int)
+            pixel = pixels[j, i]
+            simg_data.append((pixel[2] << 16) | (pixel[1] << 8) | pixel[0])
     return simg_data
 
 
 def parse_file(file_bytes: bytes, file_extension: str) -> list[int]:
     if file_extension.lower() in {'.png', '.jpg', '.bmp'}:
+        from PIL import Image
         img = Image.open(BytesIO(file_bytes))
         return img_to_simg(img)
     return list(file_bytes)
 
 
+@lru_cache(maxsize=128)
+def load_data_file(path: str, modified_time_ns: int, data_type: str) -> tuple[int, ...]:
+    """
+    Reads a data file and converts it to numbers. Cached so a file used by several entries is
+    only read and decoded once. `modified_time_ns` is part of the key so changed files are reloaded.
+    """
+    with open(path, 'rb') as f:
+        file_bytes = f.read()
+    if data_type == 'F':
+        return tuple(file_bytes)
+    return tuple(parse_file(file_bytes, os.path.splitext(path)[1]))
+
+
 # returns True if succeeded, False otherwise
 def add_data_entry(parsed_data: list, memory_size: int, line_number: int, entry: list) -> bool:
     address, numbers = entry
@@ -52,42 +82,44 @@ def add_data_entry(parsed_data: list, memory_size: int, line_number: int, entry:
 
 
 def parse_data(data_entries: str, memory_size: int) -> list | None:
-    pattern = re.compile(DATA_LINE_REGEX);
     parsed_data = []
-    for line_number, line in enumerate(data_entries.split('\n')):
-        m = pattern.match(line)
-        if not m:
+    lines = data_entries.split('\n')
+    if lines[-1] == '':
+        lines.pop()  # trailing newline at the end of the file
+    for line_number, line in enumerate(lines):
+        # each line is `[address] [f|F|b|s] [data]`, where data may contain spaces
+        parts = line.split(' ', 2)
+        if len(parts) != 3 or not parts[0].isdecimal() or parts[1] not in DATA_TYPES or not parts[2]:
             error(line_number, 'Expected [address] [f|F|b|s] [data] syntax for data entry.')
             return None
-        address_str = m.group(1)
-        data_type = m.group(2)
-        data = m.group(3)
+        address_str, data_type, data = parts
 
         if data_type == 'b':
-            if not re.match(HEX_REGEX, data):
+            if not HEX_PATTERN.match(data):
                 error(line_number, 'Expected hex value for byte data.')
                 return None
-            data_numbers = [int(data[i:i+2], base=16) for i in range(0, len(data), 2)]
+            data_numbers = list(bytes.fromhex(data))
             if not add_data_entry(parsed_data, memory_size, line_number, [int(address_str), data_numbers]):
                 return None
         
         elif data_type == 's':
-            data_numbers = [ord(c) for c in data]
-            data_numbers.insert(0, len(data))
+            data_numbers = [len(data), *map(ord, data)]
             if not add_data_entry(parsed_data, memory_size, line_number, [int(address_str), data_numbers]):
                 return None
         
         elif data_type in {'f', 'F'}:
-            if not os.path.isfile(data):
+            try:
+                file_stat = os.stat(data)
+            except OSError:
+                file_stat = None
+            if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
                 error(line_number, 'Path is either nonexistent or not a file.')
                 return None
-            with open(data, 'rb') as f:
-                file_bytes = f.read()
+            data_numbers = list(load_data_file(data, file_stat.st_mtime_ns, data_type))
             if data_type == 'F':
-                parsed_data.append([int(address_str), list(file_bytes)])
+                parsed_data.append([int(address_str), data_numbers])
                 continue
-            file_extension = os.path.splitext(data)[1]
-            entry = [int(address_str), parse_file(file_bytes, file_extension)]
+            entry = [int(address_str), data_numbers]
             if not add_data_entry(parsed_data, memory_size, line_number, entry):
                 return None
 
@@ -97,9 +129,13 @@ def parse_data(data_entries: str, memory_size: int) -> list | None:
 
     spans = [[a, a+len(data)-1] for a, data in parsed_data]
     spans.sort(key=lambda x: x[0])
-    for i in range(len(spans)-1):
-        for j in range(i+1, len(spans)):
-            if spans[i][1] >= spans[j][0]:
-                print(f'WARNING: Data overlap found between {spans[i]} and {spans[j]}.')
+    # since spans are sorted by start, each span only needs to be checked against the
+    # previous span that reaches the furthest
+    furthest_span = None
+    for span in spans:
+        if furthest_span is not None and furthest_span[1] >= span[0]:
+            print(f'WARNING: Data overlap found between {furthest_span} and {span}.')
+        if furthest_span is None or span[1] > furthest_span[1]:
+            furthest_span = span
     
     return parsed_data
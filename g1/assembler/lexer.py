@@ -0,0 +1,90 @@
+"""
+Tokenizer for g1 assembly programs.
+
+By Miles Burkart
+https://github.com/7Limes
+"""
+
+import string
+from typing import Iterator, NamedTuple
+
+
+class SourcePosition(NamedTuple):
+    idx: int
+    lineno: int
+    colno: int
+
+
+class Token(NamedTuple):
+    name: str
+    value: str
+    source_pos: SourcePosition
+
+
+class LexingError(Exception):
+    def __init__(self, source_pos: SourcePosition):
+        super().__init__(f'Unrecognized token at line {source_pos.lineno}, column {source_pos.colno}.')
+        self.source_pos = source_pos
+
+
+LETTERS = frozenset(string.ascii_letters)
+NAME_CHARS = LETTERS | {'_'}  # characters that can start a name or label
+WORD_CHARS = NAME_CHARS | frozenset(string.digits)
+
+
+def tokenize(source: str) -> Iterator[Token]:
+    """
+    Splits g1 assembly source into tokens in a single pass, dispatching on the first character of each token.
+    Spaces are skipped. Raises a `LexingError` on a character that can't start a token.
+    """
+    length = len(source)
+    lineno = 1
+    line_start = 0  # index of the first character of the current line
+    i = 0
+    while i < length:
+        char = source[i]
+        if char == ' ':
+            i += 1
+            continue
+
+        source_pos = SourcePosition(i, lineno, i-line_start+1)
+        if char == '\n':
+            yield Token('NEWLINE', char, source_pos)
+            i += 1
+            lineno += 1
+            line_start = i
+            continue
+
+        end = i+1
+        if char.isdecimal() or (char == '-' and end < length and source[end].isdecimal()):
+            while end < length and source[end].isdecimal():
+                end += 1
+            yield Token('NUMBER', source[i:end], source_pos)
+        elif char in NAME_CHARS:
+            while end < length and source[end] in WORD_CHARS:
+                end += 1
+            if end < length and source[end] == ':':
+                end += 1
+                yield Token('LABEL_NAME', source[i:end], source_pos)
+            else:
+                yield Token('NAME', source[i:end], source_pos)
+        elif char == '#' and end < length and source[end] in LETTERS:
+            while end < length and source[end] in LETTERS:
+                end += 1
+            yield Token('META_VARIABLE', source[i:end], source_pos)
+        elif char == '$' and end < length and source[end].isdecimal():
+            while end < length and source[end].isdecimal():
+                end += 1
+            yield Token('ADDRESS', source[i:end], source_pos)
+        elif char == '(':
+            end = source.find(')', end)+1
+            if end == 0:
+                raise LexingError(source_pos)
+            yield Token('COMMENT', source[i:end], source_pos)
+            newline_count = source.count('\n', i, end)
+            if newline_count:
+                lineno += newline_count
+                line_start = source.rfind('\n', i, end)+1
+        else:
+            raise LexingError(source_pos)
+        i = end
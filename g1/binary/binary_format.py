@@ -1,7 +1,19 @@
-from construct import Struct, Const, Int32ub, Int32sb, Int16ub, Int8ub, Array, this, Computed
-from typing import Any
-from construct.lib import Container, ListContainer
-from io import BytesIO
+"""
+Reads and writes the g1 binary program format (.g1b).
+
+All values are big endian.
+
+    signature           b'g1'
+    meta                memory (u32), width (u16), height (u16), tickrate (u16)
+    tick                i32, -1 if absent
+    start               i32, -1 if absent
+    instruction_count   u32
+    instructions        id (u8), then a type (u8) and value (i32) for each argument
+    data_entry_count    u32
+    data                address (u32), size (u32), then `size` values (i32)
+"""
+
+import struct
 
 from g1.instructions.instructions import INSTRUCTIONS, ARGUMENT_COUNTS
 
@@ -12,125 +24,110 @@ SIGNATURE = b'g1'
 ARG_TYPE_LITERAL = 0
 ARG_TYPE_ADDRESS = 1
 
+HEADER_FORMAT = struct.Struct('>IHHHiiI')
+COUNT_FORMAT = struct.Struct('>I')
+DATA_ENTRY_HEADER_FORMAT = struct.Struct('>II')
+# Argument formats indexed by instruction id
+ARGUMENTS_FORMATS = [struct.Struct('>' + 'Bi'*count) for count in ARGUMENT_COUNTS]
 
-G1Argument = Struct(
-    'type' / Int8ub,
-    'value' / Int32sb
-)
-
-
-G1Instruction = Struct(
-    'id' / Int8ub,
-    'argument_count' / Computed(lambda ctx: ARGUMENT_COUNTS[ctx.id]),
-    'arguments' / Array(this.argument_count, G1Argument)
-)
-
-
-G1DataEntry = Struct(
-    'address' / Int32ub,
-    'size' / Int32ub,
-    'values' / Array(this.size, Int32sb)
-)
 
+class G1BinaryFormatException(Exception):
+    pass
 
-G1BinaryFormat = Struct(
-    'signature' / Const(SIGNATURE),
-    'meta' / Struct(
-        'memory' / Int32ub,
-        'width' / Int16ub,
-        'height' / Int16ub,
-        'tickrate' / Int16ub
-    ),
-    'tick' / Int32sb,
-    'start' / Int32sb,
-    'instruction_count' / Int32ub,
-    'instructions' / Array(this.instruction_count, G1Instruction),
-    'data_entry_count' / Int32ub,
-    'data' / Array(this.data_entry_count, G1DataEntry)
-)
 
-
-def format_json(program_json: dict):
+def build_program_binary(program_json: dict) -> bytes:
     """
-    Converts a program JSON into one that can be parsed into a binary.
+    Converts a program JSON into its binary form.
     """
-    output_json = program_json.copy()
-    output_json['instruction_count'] = len(program_json['instructions'])
-    output_json.setdefault('start', -1)
-    output_json.setdefault('tick', -1)
-
-    verbose_instructions = []
-    for instruction_data in program_json['instructions']:
-        instruction_name, arguments = instruction_data[:2]  # only grab the first 2 in case of debug mode
-        verbose_arguments = []
-        for argument in arguments:
+    instructions = program_json['instructions']
+    data_entries = program_json.get('data') or []
+
+    instruction_ids = [INSTRUCTION_IDS[instruction_data[0]] for instruction_data in instructions]
+
+    size = len(SIGNATURE) + HEADER_FORMAT.size + COUNT_FORMAT.size
+    size += sum(1 + ARGUMENTS_FORMATS[instruction_id].size for instruction_id in instruction_ids)
+    size += sum(DATA_ENTRY_HEADER_FORMAT.size + 4*len(data_values) for _, data_values in data_entries)
+    buffer = bytearray(size)
+
+    buffer[:len(SIGNATURE)] = SIGNATURE
+    offset = len(SIGNATURE)
+    meta = program_json['meta']
+    HEADER_FORMAT.pack_into(
+        buffer, offset,
+        meta['memory'], meta['width'], meta['height'], meta['tickrate'],
+        program_json.get('tick', -1), program_json.get('start', -1),
+        len(instructions)
+    )
+    offset += HEADER_FORMAT.size
+
+    for instruction_id, instruction_data in zip(instruction_ids, instructions):
+        arguments_format = ARGUMENTS_FORMATS[instruction_id]
+        flat_arguments = []
+        for argument in instruction_data[1]:
             if isinstance(argument, int):
-                verbose_arguments.append({'type': ARG_TYPE_LITERAL, 'value': argument})
+                flat_arguments += (ARG_TYPE_LITERAL, argument)
             else:
-                verbose_arguments.append({'type': ARG_TYPE_ADDRESS, 'value': int(argument[1:])})
-        instruction_id = INSTRUCTION_IDS[instruction_name]
-        verbose_instruction = {
-            'id': instruction_id,
-            'arguments': verbose_arguments
-        }
-        verbose_instructions.append(verbose_instruction)
-    output_json['instructions'] = verbose_instructions
-
-    if 'data' in program_json:
-        verbose_data_entries = []
-        for address, data_values in program_json['data']:
-            verbose_data_entries.append({'address': address, 'size': len(data_values), 'values': data_values})
-        output_json['data_entry_count'] = len(verbose_data_entries)
-        output_json['data'] = verbose_data_entries
-    else:
-        output_json['data_entry_count'] = 0
-        output_json['data'] = {}
-
-    return output_json
-
-
-def container_to_dict(container: Any):
-    if isinstance(container, Container):
-        return {key: container_to_dict(value) for key, value in container.items() if not key.startswith('_')}
-    elif isinstance(container, ListContainer):
-        return [container_to_dict(item) for item in container]
-    elif isinstance(container, BytesIO):
-        return int.from_bytes(container, 'big')
-    else:
-        return container
-    
+                flat_arguments += (ARG_TYPE_ADDRESS, int(argument[1:]))
+        buffer[offset] = instruction_id
+        arguments_format.pack_into(buffer, offset+1, *flat_arguments)
+        offset += 1 + arguments_format.size
+
+    COUNT_FORMAT.pack_into(buffer, offset, len(data_entries))
+    offset += COUNT_FORMAT.size
+    for address, data_values in data_entries:
+        DATA_ENTRY_HEADER_FORMAT.pack_into(buffer, offset, address, len(data_values))
+        offset += DATA_ENTRY_HEADER_FORMAT.size
+        struct.pack_into(f'>{len(data_values)}i', buffer, offset, *data_values)
+        offset += 4*len(data_values)
+
+    return bytes(buffer)
+
 
 def parse_to_program_data(file_content: bytes) -> dict:
-    parsed_data = G1BinaryFormat.parse(file_content)
-    program_data = container_to_dict(parsed_data)
-
-    # Remove unnecessary fields
-    del program_data['signature']
-    del program_data['instruction_count']
-    if program_data['start'] == -1:
-        del program_data['start']
-    if program_data['tick'] == -1:
-        del program_data['tick']
-    if not program_data['data']:
-        del program_data['data_entry_count']
-        del program_data['data']
-    
-    def convert_argument(arg_data: dict) -> int|str:
-        if arg_data['type'] == ARG_TYPE_LITERAL:
-            return arg_data['value']
-        return f'${arg_data["value"]}'
-    
-    new_instructions = []
-    for instruction_data in program_data['instructions']:
-        instruction_name = INSTRUCTIONS[instruction_data['id']]
-        converted_args = [convert_argument(a) for a in instruction_data['arguments']]
-        new_instructions.append([instruction_name, converted_args])
-    program_data['instructions'] = new_instructions
-    
-    if program_data.get('data'):
-        new_data_entries = []
-        for data_entry in program_data['data']:
-            new_data_entries.append([data_entry['address'], data_entry['values']])
-        program_data['data'] = new_data_entries
-
-    return program_data
\ No newline at end of file
+    if not file_content.startswith(SIGNATURE):
+        raise G1BinaryFormatException('File does not start with the g1 binary signature.')
+    view = memoryview(file_content)
+    offset = len(SIGNATURE)
+    try:
+        memory, width, height, tickrate, tick, start, instruction_count = HEADER_FORMAT.unpack_from(view, offset)
+        offset += HEADER_FORMAT.size
+        program_data = {
+            'meta': {
+                'memory': memory,
+                'width': width,
+                'height': height,
+                'tickrate': tickrate
+            }
+        }
+        if tick != -1:
+            program_data['tick'] = tick
+        if start != -1:
+            program_data['start'] = start
+
+        instructions = []
+        for _ in range(instruction_count):
+            instruction_id = view[offset]
+            arguments_format = ARGUMENTS_FORMATS[instruction_id]
+            flat_arguments = arguments_format.unpack_from(view, offset+1)
+            offset += 1 + arguments_format.size
+            arguments = [
+                value if arg_type == ARG_TYPE_LITERAL else f'${value}'
+                for arg_type, value in zip(flat_arguments[::2], flat_arguments[1::2])
+            ]
+            instructions.append([INSTRUCTIONS[instruction_id], arguments])
+        program_data['instructions'] = instructions
+
+        data_entry_count, = COUNT_FORMAT.unpack_from(view, offset)
+        offset += COUNT_FORMAT.size
+        data_entries = []
+        for _ in range(data_entry_count):
+            address, size = DATA_ENTRY_HEADER_FORMAT.unpack_from(view, offset)
+            offset += DATA_ENTRY_HEADER_FORMAT.size
+            data_entries.append([address, list(struct.unpack_from(f'>{size}i', view, offset))])
+            offset += 4*size
+        if data_entries:
+            program_data['data'] = data_entries
+    except (struct.error, IndexError) as e:
+        raise G1BinaryFormatException(f'Malformed g1 binary: {e}')
+
+    return program_data
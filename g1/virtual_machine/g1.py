@@ -9,132 +9,250 @@ import os
 import json
 import sys
 import argparse
-from g1.binary.binary_format import SIGNATURE as BINARY_FORMAT_SIGNATURE, parse_to_program_data
+from array import array
+from typing import Callable
 from g1.instructions.instructions import INSTRUCTIONS
+from g1.binary.binary_format import SIGNATURE as BINARY_FORMAT_SIGNATURE, INSTRUCTION_IDS, ARG_TYPE_LITERAL, ARG_TYPE_ADDRESS, parse_to_program_data
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 import pygame
 
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+try:
+    from g1.virtual_machine.jit import NATIVE_OPS, as_native_memory, pack_instructions, run_block
+    JIT_ENABLED = True
+except ImportError:  # numba and numpy are optional
+    JIT_ENABLED = False
+
 class G1PyException(Exception):
     pass
 
+class G1RuntimeError(G1PyException):
+    pass
+
+
+class CompiledProgram:
+    def __init__(self, ops: list[int], arg_kinds: list[tuple[int, ...]], arg_vals: list[tuple[int, ...]], specialized: list[Callable], src_lines: list[int]|None):
+        self.ops = ops
+        self.arg_kinds = arg_kinds
+        self.arg_vals = arg_vals
+        self.specialized = specialized
+        self.src_lines = src_lines
+        self.packed = pack_instructions(ops, arg_kinds, arg_vals) if JIT_ENABLED else None
+        self.native = [op in NATIVE_OPS for op in ops] if JIT_ENABLED else None  # whether run_block can run each instruction
+
+
 class ProgramContext:
-    def __init__(self, program_data: dict, surface: pygame.Surface, data: list[list]|None=None):
+    def __init__(self, program_data: dict, compiled_program: CompiledProgram, surface: pygame.Surface, data: list[list]|None=None):
         self.program_data = program_data
+        self.compiled_program = compiled_program
         amount_memory = program_data['meta']['memory']
-        self.memory = [0] * amount_memory
+        if amount_memory < RESERVED_MEMORY_SIZE:
+            raise G1PyException(f'ERROR: Programs need at least {RESERVED_MEMORY_SIZE} memory slots for reserved values but only {amount_memory} were allocated.')
+        self.memory = array('i', bytes(4*amount_memory))  # signed 32 bit integers
         if data is not None:
             for address, data_numbers in data:
                 upper_bound = address+len(data_numbers)
                 if upper_bound > amount_memory:
                     raise G1PyException(f'ERROR: Data entry spans from {address} to {upper_bound} but only {amount_memory} slots were allocated. Consider allocating more memory.')
-                self.memory[address:upper_bound] = data_numbers
+                self.memory[address:upper_bound] = array('i', data_numbers)
+        self.native_memory = as_native_memory(self.memory) if JIT_ENABLED else None
+
+        # Values for $0-$12, copied into memory every tick. $8-$11 never change.
+        meta = program_data['meta']
+        self.reserved_memory = array('i', bytes(4*RESERVED_MEMORY_SIZE))
+        self.reserved_memory[8:12] = array('i', (meta['memory'], meta['width'], meta['height'], meta['tickrate']))
 
         self.program_counter = 0
         self.color = (0, 0, 0)
         self.surface = surface
+        self.mapped_color = surface.map_rgb(self.color)  # the color as a pixel value, used for drawing points
 
 
 def error(program_context: ProgramContext, message: str):
     print('RUNTIME ERROR:', message)
     source_lines = program_context.program_data.get('source')
     if source_lines is not None:
-        program_counter = program_context.program_counter
-        line_number = program_context.program_data['instructions'][program_counter][2]
+        line_number = program_context.compiled_program.src_lines[program_context.program_counter]
         print(f'{line_number+1} | {source_lines[line_number]}')
     sys.exit()
 
 
-def memget(program_context: ProgramContext, index: int) -> int:
-    if index < 0 or index >= len(program_context.memory):
-        error(program_context, f'Cannot get at address {index} since it is out of bounds.')
-    return program_context.memory[index]
-
-def memset(program_context: ProgramContext, index: int, value: int):
-    if index < 0 or index >= len(program_context.memory):
-        error(program_context, f'Cannot set at address {index} since it is out of bounds.')
-    program_context.memory[index] = value
-
-
-def parse_arguments(program_context: ProgramContext, args: list[int|str]):
-    return [memget(program_context, int(arg[1:])) if isinstance(arg, str) else arg for arg in args]
-
-def ins_mov(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], args[1])
- 
-def ins_movp(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], memget(program_context, args[1]))
-
-def ins_add(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], args[1] + args[2])
-
-def ins_sub(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], args[1] - args[2])
+def wrap_int32(value: int) -> int:
+    return (value + 2**31) % 2**32 - 2**31
 
-def ins_mul(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], args[1] * args[2])
 
-def ins_div(program_context: ProgramContext, args: list[int|str]):
-    if args[2] == 0:
-        error(program_context, 'Division by zero.')
-    memset(program_context, args[0], args[1] // args[2])
-
-def ins_mod(program_context: ProgramContext, args: list[int|str]):
-    if args[2] == 0:
-        error(program_context, 'Division by zero.')
-    memset(program_context, args[0], args[1] % args[2])
-
-def ins_less(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], int(args[1] < args[2]))
-
-def ins_equal(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], int(args[1] == args[2]))
-
-def ins_not(program_context: ProgramContext, args: list[int|str]):
-    memset(program_context, args[0], int(not args[1]))
-
-def ins_jmp(_: ProgramContext, args: list[int|str]):
-    if args[1]:
-        return args[0]
+def get_pixel_int(surface: pygame.Surface, x: int, y: int) -> int:
+    try:
+        pixel = surface.get_at((x, y))
+    except IndexError:
+        return -1
+    return (pixel.b << 16) | (pixel.g << 8) | pixel.r
 
-def ins_color(program_context: ProgramContext, args: list[int|str]):
-    program_context.color = (args[0], args[1], args[2])
 
-def ins_point(program_context: ProgramContext, args: list[int|str]):
-    program_context.surface.set_at((args[0], args[1]), program_context.color)
+def map_color(surface: pygame.Surface, color: tuple[int, int, int]) -> int | tuple[int, int, int]:
+    """
+    Returns the color as a pixel value for drawing points.
+    Invalid colors are returned unchanged so the error is raised when something is drawn with them.
+    """
+    try:
+        return surface.map_rgb(color)
+    except ValueError:
+        return color
+
+
+# Value expressions for instructions that store a result at the address given by their first argument.
+# `{1}`, `{2}` are replaced with the instruction's remaining operands when it is specialized.
+ASSIGNMENT_TEMPLATES = {
+    'mov': '{1}',
+    'movp': 'm[{1}]',
+    'add': '{1} + {2}',
+    'sub': '{1} - {2}',
+    'mul': '{1} * {2}',
+    'div': '{1} // {2}',
+    'mod': '{1} % {2}',
+    'less': 'int({1} < {2})',
+    'equal': 'int({1} == {2})',
+    'not': 'int(not {1})',
+    'getp': 'get_pixel_int(ctx.surface, {1}, {2})'
+}
+
+# Assignment instructions whose result can fall outside the 32 bit signed integer range and wrap around.
+WRAPPING_INSTRUCTIONS = {'add', 'sub', 'mul', 'div'}
+
+# Statements for every other instruction.
+STATEMENT_TEMPLATES = {
+    'jmp': 'if {1}: return {0}',
+    'color': 'ctx.color = ({0}, {1}, {2}); ctx.mapped_color = map_color(ctx.surface, ctx.color)',
+    'point': 'ctx.surface.set_at(({0}, {1}), ctx.mapped_color)',
+    'line': 'draw_line(ctx.surface, ctx.color, ({0}, {1}), ({2}, {3}))',
+    'rect': 'draw_rect(ctx.surface, ctx.color, ({0}, {1}, {2}, {3}))',
+    'log': 'print({0})'
+}
+
+SPECIALIZE_GLOBALS = {
+    'draw_line': pygame.draw.line,
+    'draw_rect': pygame.draw.rect,
+    'G1RuntimeError': G1RuntimeError,
+    'wrap_int32': wrap_int32,
+    'get_pixel_int': get_pixel_int,
+    'map_color': map_color
+}
+
+
+def address_check(operand: str, memory_size: int, action: str) -> list[str]:
+    """
+    Returns the source lines needed to bounds check an address operand.
+    Literal addresses are checked here so only computed addresses are checked at runtime.
+    """
+    out_of_bounds_error = f"raise G1RuntimeError(f'Cannot {action} at address {{{operand}}} since it is out of bounds.')"
+    if operand.lstrip('-').isdigit():
+        return [] if 0 <= int(operand) < memory_size else [out_of_bounds_error]
+    return [f'if {operand} < 0 or {operand} >= {memory_size}:', f'    {out_of_bounds_error}']
 
-def ins_line(program_context: ProgramContext, args: list[int|str]):
-    pygame.draw.line(program_context.surface, program_context.color, (args[0], args[1]), (args[2], args[3]))
 
-def ins_rect(program_context: ProgramContext, args: list[int|str]):
-    pygame.draw.rect(program_context.surface, program_context.color, (args[0], args[1], args[2], args[3]))
+def specialize(op_id: int, arg_kinds: tuple[int, ...], arg_vals: tuple[int, ...], memory_size: int) -> str:
+    """
+    Generates the source of a function that runs a single instruction with its argument
+    addressing modes baked in, so running it needs no argument decoding.
+    """
+    instruction_name = INSTRUCTIONS[op_id]
+    body = []
+    operands = []
+    for kind, value in zip(arg_kinds, arg_vals):
+        if kind == ARG_TYPE_ADDRESS:
+            body += address_check(str(value), memory_size, 'get')
+            operands.append(f'm[{value}]')
+        else:
+            operands.append(str(value))
+
+    if instruction_name in ASSIGNMENT_TEMPLATES:
+        if instruction_name == 'movp':
+            body += address_check(operands[1], memory_size, 'get')
+        elif instruction_name in {'div', 'mod'} and operands[2] == '0':
+            body.append("raise G1RuntimeError('Division by zero.')")  # divisors read from memory raise ZeroDivisionError
+        value = ASSIGNMENT_TEMPLATES[instruction_name].format(*operands)
+        destination_check = address_check(operands[0], memory_size, 'set')
+        if destination_check and instruction_name in {'div', 'mod'}:
+            # compute the value first so division by zero is reported before a bad destination
+            body.append(f'v = {value}')
+            value = 'v'
+        body += destination_check
+        if instruction_name in WRAPPING_INSTRUCTIONS:
+            body += [
+                'try:',
+                f'    m[{operands[0]}] = {value}',
+                'except OverflowError:',
+                f'    m[{operands[0]}] = wrap_int32({value})'
+            ]
+        else:
+            body.append(f'm[{operands[0]}] = {value}')
+    else:
+        body.append(STATEMENT_TEMPLATES[instruction_name].format(*operands))
 
-def ins_log(_: ProgramContext, args: list[int|str]):
-    print(args[0])
+    body_source = '\n    '.join(body)
+    return f'def f(ctx):\n    m = ctx.memory\n    {body_source}\n'
 
-def ins_getp(program_context: ProgramContext, args: list[int|str]):
-    try:
-        pixel = program_context.surface.get_at((args[1], args[2]))
-        pixel_int = (pixel.b << 16) | (pixel.g << 8) | pixel.r
-        memset(program_context, args[0], pixel_int)
-    except IndexError:
-        memset(program_context, args[0], -1)
 
+def decode_arguments(instruction_args: list[int|str]) -> tuple[tuple[int, ...], tuple[int, ...]]:
+    """
+    Splits instruction arguments into their kinds (literal or address) and values.
+    """
+    kinds = []
+    vals = []
+    for arg in instruction_args:
+        if isinstance(arg, str):
+            kinds.append(ARG_TYPE_ADDRESS)
+            vals.append(int(arg[1:]))
+        else:
+            kinds.append(ARG_TYPE_LITERAL)
+            vals.append(arg)
+    return tuple(kinds), tuple(vals)
 
-INSTRUCTION_FUNCTIONS = [
-    ins_mov, ins_movp,
-    ins_add, ins_sub, ins_mul, ins_div, ins_mod,
-    ins_less, ins_equal, ins_not,
-    ins_jmp,
-    ins_color, ins_point, ins_line, ins_rect,
-    ins_log,
-    ins_getp
-]
 
-INSTRUCTION_LOOKUP = {ins: func for ins, func in zip(INSTRUCTIONS, INSTRUCTION_FUNCTIONS)}
+def no_op(_: ProgramContext):
+    pass
 
 
-def print_memory(memory: list[int], lower: int, upper: int):
+def compile_program(program_data: dict, disable_log: bool=False) -> CompiledProgram:
+    """
+    Decodes the program's instructions once into flat opcode and argument lists
+    and specializes each instruction into its own function.
+    If `disable_log` is set, log instructions are compiled to no-ops.
+    """
+    memory_size = program_data['meta']['memory']
+    ops = []
+    arg_kinds = []
+    arg_vals = []
+    specialized = []
+    specialized_cache = {}  # identical instructions share one function
+    log_op = INSTRUCTION_IDS['log']
+    src_lines = [] if 'source' in program_data else None
+    for instruction_data in program_data['instructions']:
+        instruction_name, instruction_args = instruction_data[0], instruction_data[1]  # debug mode appends a line number
+        op = INSTRUCTION_IDS[instruction_name]
+        kinds, vals = decode_arguments(instruction_args)
+        key = (op, kinds, vals)
+        if disable_log and op == log_op:
+            specialized_cache[key] = no_op
+        elif key not in specialized_cache:
+            namespace = {}
+            exec(specialize(op, kinds, vals, memory_size), SPECIALIZE_GLOBALS, namespace)
+            specialized_cache[key] = namespace['f']
+        ops.append(op)
+        arg_kinds.append(kinds)
+        arg_vals.append(vals)
+        specialized.append(specialized_cache[key])
+        if src_lines is not None:
+            src_lines.append(instruction_data[2])
+    return CompiledProgram(ops, arg_kinds, arg_vals, specialized, src_lines)
+
+
+def print_memory(memory: array, lower: int, upper: int):
     max_length = max(max([len(str(memory[i])) for i in range(lower, upper)]), 5)
     print('Address  ', end='')
     for i in range(lower, upper):
@@ -146,6 +264,17 @@ def print_memory(memory: list[int], lower: int, upper: int):
     print()
 
 
+def print_step(program_context: ProgramContext, program_counter: int):
+    source_lines = program_context.program_data.get('source')
+    if source_lines is not None:
+        line_number = program_context.compiled_program.src_lines[program_counter]
+        print(f'Ran {program_counter}: {source_lines[line_number].lstrip()}')
+    else:
+        instruction_data = program_context.program_data['instructions'][program_counter]
+        instruction_name, instruction_args = instruction_data[0], instruction_data[1]
+        print(f'Ran {program_counter}: {instruction_name} {" ".join(map(str, instruction_args))}')
+
+
 def run_step_command(program_context: ProgramContext, command: str) -> int | None:
     if command.strip() == '':
         return 1
@@ -165,60 +294,62 @@ def run_step_command(program_context: ProgramContext, command: str) -> int | Non
         return None
 
 
-def start_program_thread(program_context: ProgramContext, index: int, step: bool=False, disable_log: bool=False):
-    program_context.program_counter = index
-    instructions = program_context.program_data['instructions']
-    source_lines = program_context.program_data.get('source')
+def start_program_thread(program_context: ProgramContext, index: int, step: bool=False):
+    compiled_program = program_context.compiled_program
+    specialized = compiled_program.specialized
+    packed = None if step else compiled_program.packed
+    native_memory = program_context.native_memory
+    run_native = run_block if packed is not None else None
+    native = compiled_program.native
+    instruction_count = len(specialized)
     step_amount = 0
-    while program_context.program_counter < len(instructions):
-        instruction_name, instruction_args = instructions[program_context.program_counter][:2]  # only grab the first 2 in case of debug mode
-        if disable_log and instruction_name == 'log':
-            program_context.program_counter += 1
-            continue
-        
-        parsed_arguments = parse_arguments(program_context, instruction_args)
-        new_program_counter = INSTRUCTION_LOOKUP[instruction_name](program_context, parsed_arguments)
-        
-        if step:
-            if source_lines is not None:
-                line_number = instructions[program_context.program_counter][2]
-                print(f'Ran {program_context.program_counter}: {source_lines[line_number].lstrip()}')
-            else:
-                print(f'Ran {program_context.program_counter}: {instruction_name} {" ".join(map(str, instruction_args))}')
-            if step_amount > 1:
-                step_amount -= 1
-            else:
-                while True:
-                    step_amount = run_step_command(program_context, input('> '))
-                    if step_amount is not None:
-                        break
-        
-        if new_program_counter is not None:
-            program_context.program_counter = new_program_counter
-        else:
-            program_context.program_counter += 1
+    pc = index
+    try:
+        while pc < instruction_count:
+            if packed is not None and native[pc]:  # entering native code costs more than running a single Python instruction
+                pc = run_native(packed, native_memory, pc)
+                if pc >= instruction_count:
+                    break
+            new_pc = specialized[pc](program_context)
+
+            if step and specialized[pc] is not no_op:  # disabled logs are skipped while stepping
+                print_step(program_context, pc)
+                if step_amount > 1:
+                    step_amount -= 1
+                else:
+                    while True:
+                        step_amount = run_step_command(program_context, input('> '))
+                        if step_amount is not None:
+                            break
+
+            pc = new_pc if new_pc is not None else pc+1
+    except G1RuntimeError as e:
+        program_context.program_counter = pc
+        error(program_context, str(e))
+    except ZeroDivisionError:
+        program_context.program_counter = pc
+        error(program_context, 'Division by zero.')
+    program_context.program_counter = pc
+
+
+# Input states and program info are written to $0-$12 every tick
+RESERVED_MEMORY_SIZE = 13
+
+# Keys for the input button states at $0-$7
+INPUT_KEYS = (
+    pygame.K_RETURN, pygame.K_RSHIFT,
+    pygame.K_z, pygame.K_x,
+    pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT
+)
 
 
 def update_reserved_memory(program_context: ProgramContext, delta_ms: int):
-    meta = program_context.program_data['meta']
     keys = pygame.key.get_pressed()
-    values = [
-        int(keys[pygame.K_RETURN]),
-        int(keys[pygame.K_RSHIFT]),
-        int(keys[pygame.K_z]),
-        int(keys[pygame.K_x]),
-        int(keys[pygame.K_UP]),
-        int(keys[pygame.K_DOWN]),
-        int(keys[pygame.K_LEFT]),
-        int(keys[pygame.K_RIGHT]),
-
-        meta['memory'],
-        meta['width'],
-        meta['height'],
-        meta['tickrate'],
-        delta_ms
-    ]
-    program_context.memory[0:len(values)] = values
+    reserved_memory = program_context.reserved_memory
+    for address, key in enumerate(INPUT_KEYS):
+        reserved_memory[address] = keys[key]
+    reserved_memory[12] = delta_ms
+    program_context.memory[:RESERVED_MEMORY_SIZE] = reserved_memory
 
 
 def run(program_data: dict, render_scale: int=1, show_fps: bool=False, enable_step: bool=False, disable_log: bool=False):
@@ -235,14 +366,18 @@ def run(program_data: dict, render_scale: int=1, show_fps: bool=False, enable_st
     height = program_data['meta']['height']
     tickrate = program_data['meta']['tickrate']
     win = pygame.display.set_mode((width*render_scale, height*render_scale))
-    draw_surface = pygame.Surface((width, height))
+    if render_scale == 1 and not show_fps:
+        draw_surface = win  # nothing to scale or draw over, so the program can draw to the window directly
+    else:
+        draw_surface = pygame.Surface((width, height))
     pygame.display.set_caption('g1py')
     font = pygame.font.SysFont('Arial', 15)
 
-    program_context = ProgramContext(program_data, draw_surface, program_data.get('data'))
+    compiled_program = compile_program(program_data, disable_log)
+    program_context = ProgramContext(program_data, compiled_program, draw_surface, program_data.get('data'))
     if 'start' in program_data:
         update_reserved_memory(program_context, 0)
-        start_program_thread(program_context, program_data['start'], enable_step, disable_log)
+        start_program_thread(program_context, program_data['start'], enable_step)
 
     if 'tick' not in program_data:
         return
@@ -257,10 +392,10 @@ def run(program_data: dict, render_scale: int=1, show_fps: bool=False, enable_st
                 running = False
 
         update_reserved_memory(program_context, delta_ms)
-        start_program_thread(program_context, tick_label_index, step=False, disable_log=disable_log)
+        start_program_thread(program_context, tick_label_index, step=False)
 
-        resized_draw_surface = pygame.transform.scale(draw_surface, (width*render_scale, height*render_scale))
-        win.blit(resized_draw_surface, (0, 0))
+        if draw_surface is not win:
+            pygame.transform.scale(draw_surface, (width*render_scale, height*render_scale), win)
 
         if show_fps:
             fps_surf = font.render(f'{clock.get_fps():.2f}', True, (255, 0, 0))
@@ -277,6 +412,8 @@ def run_file(file_path: str, render_scale: int=1, show_fps: bool=False, enable_s
         file_content = f.read()
         if file_content.startswith(BINARY_FORMAT_SIGNATURE):
             program_data = parse_to_program_data(file_content)
+        elif orjson is not None:
+            program_data = orjson.loads(file_content)
         else:
             program_data = json.loads(file_content.decode())
 
@@ -0,0 +1,121 @@
+"""
+A native inner loop for the g1 virtual machine, compiled with Numba.
+
+Memory, arithmetic, comparison and jump instructions run natively. Everything
+else (graphics, logging, runtime errors) is handed back to the Python interpreter.
+"""
+
+import numpy as np
+from array import array
+from numba import njit
+from g1.instructions.instructions import INSTRUCTIONS, ARGUMENT_COUNTS
+
+
+OP_MOV = INSTRUCTIONS.index('mov')
+OP_MOVP = INSTRUCTIONS.index('movp')
+OP_ADD = INSTRUCTIONS.index('add')
+OP_SUB = INSTRUCTIONS.index('sub')
+OP_MUL = INSTRUCTIONS.index('mul')
+OP_DIV = INSTRUCTIONS.index('div')
+OP_MOD = INSTRUCTIONS.index('mod')
+OP_LESS = INSTRUCTIONS.index('less')
+OP_EQUAL = INSTRUCTIONS.index('equal')
+OP_NOT = INSTRUCTIONS.index('not')
+OP_JMP = INSTRUCTIONS.index('jmp')
+
+# Opcodes run_block can run natively
+NATIVE_OPS = frozenset(range(OP_MOV, OP_JMP+1))
+
+# Instructions run_block runs before returning, so Python can handle signals like KeyboardInterrupt
+INSTRUCTION_BUDGET = 2**20
+
+# Each packed instruction is [op, kind0, value0, kind1, value1, ...]
+PACKED_WIDTH = 1 + 2*max(ARGUMENT_COUNTS)
+
+
+def as_native_memory(memory: array) -> np.ndarray:
+    """
+    Returns an int32 ndarray that shares its buffer with the VM's memory array.
+    """
+    return np.frombuffer(memory, dtype=np.int32)
+
+
+def pack_instructions(ops: list[int], arg_kinds: list[tuple[int, ...]], arg_vals: list[tuple[int, ...]]) -> np.ndarray:
+    packed = np.zeros((len(ops), PACKED_WIDTH), dtype=np.int32)
+    for i, op in enumerate(ops):
+        packed[i, 0] = op
+        for j, (kind, value) in enumerate(zip(arg_kinds[i], arg_vals[i])):
+            packed[i, 1+2*j] = kind
+            packed[i, 2+2*j] = value
+    return packed
+
+
+@njit(cache=True)
+def run_block(packed: np.ndarray, memory: np.ndarray, pc: int) -> int:
+    """
+    Runs instructions starting at `pc` until reaching one that must be run by Python,
+    the end of the program or the instruction budget. Returns the program counter it stopped at.
+    """
+    instruction_count = packed.shape[0]
+    memory_size = memory.shape[0]
+    for _ in range(INSTRUCTION_BUDGET):
+        if pc < 0 or pc >= instruction_count:  # let Python handle jumps outside the program
+            return pc
+        op = packed[pc, 0]
+        if op > OP_JMP:
+            return pc
+
+        a0 = packed[pc, 2]
+        if packed[pc, 1]:
+            if a0 < 0 or a0 >= memory_size:
+                return pc
+            a0 = memory[a0]
+        a1 = packed[pc, 4]
+        if packed[pc, 3]:
+            if a1 < 0 or a1 >= memory_size:
+                return pc
+            a1 = memory[a1]
+        a2 = packed[pc, 6]
+        if packed[pc, 5]:
+            if a2 < 0 or a2 >= memory_size:
+                return pc
+            a2 = memory[a2]
+
+        if op == OP_JMP:
+            pc = a0 if a1 != 0 else pc+1
+            if pc < 0:
+                return pc
+            continue
+
+        if op == OP_MOV:
+            value = np.int64(a1)
+        elif op == OP_MOVP:
+            if a1 < 0 or a1 >= memory_size:
+                return pc
+            value = np.int64(memory[a1])
+        elif op == OP_ADD:
+            value = np.int64(a1) + a2
+        elif op == OP_SUB:
+            value = np.int64(a1) - a2
+        elif op == OP_MUL:
+            value = np.int64(a1) * a2
+        elif op == OP_DIV:
+            if a2 == 0:
+                return pc
+            value = np.int64(a1) // a2
+        elif op == OP_MOD:
+            if a2 == 0:
+                return pc
+            value = np.int64(a1) % a2
+        elif op == OP_LESS:
+            value = np.int64(1 if a1 < a2 else 0)
+        elif op == OP_EQUAL:
+            value = np.int64(1 if a1 == a2 else 0)
+        else:  # OP_NOT
+            value = np.int64(1 if a1 == 0 else 0)
+
+        if a0 < 0 or a0 >= memory_size:
+            return pc
+        memory[a0] = value
+        pc += 1
+    return pc